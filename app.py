@@ -1,10 +1,23 @@
 import os
-import json
+import asyncio
+import functools
+import itertools
 import logging
-import threading
-from flask import Flask, request, jsonify, Response, send_from_directory
-from flask_cors import CORS
+import random
+import time
+import weakref
+from typing import Optional
+from collections import deque
+from cachetools import TTLCache
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, ORJSONResponse, StreamingResponse
+from pydantic import BaseModel
 from dotenv import load_dotenv
+import uvicorn
+import orjson
+import redis.asyncio as aioredis
+from redis.exceptions import WatchError
 from llama_index.llms.groq import Groq as LlamaGroq
 from llama_index.core.llms import ChatMessage, MessageRole
 from uuid import uuid4
@@ -12,178 +25,409 @@ from uuid import uuid4
 load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-app = Flask(__name__, static_folder=None)
-CORS(app)
+# Read once at import so a missing key shows up at startup (including under `uvicorn app:app`), not on the first chat.
+GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
+if not GROQ_API_KEY:
+    # For security, set GROQ_API_KEY as an environment variable (or in .env), e.g. export GROQ_API_KEY="gsk_..."
+    logging.warning("GROQ_API_KEY not found in environment variables. LLM calls will fail until it is configured.")
 
-# Session Management: Stores history as LlamaIndex ChatMessage compatible dicts
-session_histories = {}
-history_lock = threading.Lock()
+app = FastAPI(default_response_class=ORJSONResponse)
+# Resolved from this module's location so the app can be started from any working directory
+INDEX_HTML = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'index.html')
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
 
-def initialize_session_history(session_id):
-    with history_lock:
-        if session_id not in session_histories:
-            session_histories[session_id] = []  # Store list of dicts: {"role": ..., "content": ...}
-            logging.info(f"Initialized history for new session: {session_id}")
-        return session_histories[session_id]
+# /chat request body, parsed and validated once by FastAPI (malformed requests get a 422 before any LLM call)
+class ChatRequest(BaseModel):
+    # Optional so a null session_id (e.g. /create-session failed) gets the in-stream error, not a bare 422
+    session_id: Optional[str] = None
+    prompt: str
+    system_prompt: str = ""
+    temperature: float = 0.7
+    model_id: str = "llama3-8b-8192"
 
-@app.route('/')
-def serve_index():
-    return send_from_directory('.', 'index.html')
+# Session Management: each session keeps a cache-stable prompt prefix:
+#   "system_prompt": static system prompt, replaced wholesale (new cache epoch) when the client changes it
+#   "committed": append-only deque of LlamaIndex ChatMessage objects (plain dicts only at the Redis boundary)
+# Sessions live in Redis when REDIS_URL is set (so any worker can serve any session), otherwise in this process.
+REDIS_URL = os.environ.get("REDIS_URL")
+redis_client = aioredis.from_url(REDIS_URL, decode_responses=True) if REDIS_URL else None
+SESSION_TTL_SECONDS = 86400
+# Optimistic Redis updates give up after this many WATCH conflicts, backing off with jitter between attempts
+SESSION_UPDATE_MAX_RETRIES = 10
+MAX_SESSIONS = 10_000
 
-@app.route('/create-session', methods=['POST'])
-def create_session_route():
+class SessionCache(TTLCache):
+    # TTLCache that logs sessions dropped for being idle or to make room for new ones.
+    def popitem(self):
+        session_id, session = super().popitem()
+        logging.info(f"Evicted session {session_id} to stay within {self.maxsize} sessions.")
+        return session_id, session
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        # cachetools < 5.4 returns None here rather than the expired pairs
+        for session_id, _ in expired or ():
+            logging.info(f"Expired idle session: {session_id}")
+        return expired
+
+# Bounded so abandoned sessions don't accumulate for the life of the process
+session_histories = SessionCache(maxsize=MAX_SESSIONS, ttl=SESSION_TTL_SECONDS)
+# Token budget for the system prompt plus history sent on each call; oldest turns are evicted first.
+MAX_HISTORY_TOKENS = 4096
+# Once over budget, evict down to this lower target instead of just under the cap. Trimming only to the
+# cap would drop the head on every turn and change the cached [system][committed] prefix each call;
+# the headroom keeps the prefix stable for several turns between evictions.
+EVICTION_TARGET_TOKENS = MAX_HISTORY_TOKENS * 3 // 4
+# Once a session holds more than SUMMARY_THRESHOLD committed messages, up to the oldest SUMMARY_BATCH
+# are folded into one summary message. The batch is trimmed to end on an assistant reply, so the
+# remaining history still starts on a user turn even when its head is an earlier summary.
+SUMMARY_THRESHOLD = 20
+SUMMARY_BATCH = 10
+# Groq deltas are often only a few characters; coalesce them into one SSE frame per ~32 chars or 20 ms.
+STREAM_FLUSH_CHARS = 32
+STREAM_FLUSH_INTERVAL = 0.02
+# One asyncio.Lock per session, so only concurrent requests for the same session (e.g. two tabs) serialize.
+# Weak values let a lock disappear once no request holds it, instead of outliving its session.
+session_locks = weakref.WeakValueDictionary()
+
+def get_session_lock(session_id):
+    # No await between the lookup and the insert, so this is atomic on the event loop without a meta lock.
+    lock = session_locks.get(session_id)
+    if lock is None:
+        lock = session_locks[session_id] = asyncio.Lock()
+    return lock
+
+def _new_session():
+    return {"system_prompt": "", "committed": deque()}
+
+def _ensure_session_history(session_id):
+    # Caller must already hold the session lock (asyncio.Lock is not reentrant).
+    if session_id not in session_histories:
+        session_histories[session_id] = _new_session()
+        logging.info(f"Initialized history for new session: {session_id}")
+    return session_histories[session_id]
+
+def _redis_key(session_id):
+    return f"sess:{session_id}"
+
+# Plain dict lookup for the stored role strings, cheaper than constructing MessageRole(value) per message
+_ROLE_BY_VALUE = {role.value: role for role in MessageRole}
+
+def _session_to_json(session):
+    committed = [{"role": m.role.value, "content": m.content} for m in session["committed"]]
+    return orjson.dumps({"system_prompt": session["system_prompt"], "committed": committed})
+
+def _session_from_json(raw):
+    data = orjson.loads(raw)
+    data["committed"] = deque(ChatMessage(role=_ROLE_BY_VALUE[m["role"]], content=m["content"]) for m in data["committed"])
+    return data
+
+async def update_session(session_id, mutate):
+    # Runs mutate(session) as one atomic read-modify-write, creating the session if needed, and returns
+    # its result. mutate returns (result, changed); an unchanged existing Redis session is not written back.
+    # In-memory sessions serialize on the per-session lock; Redis sessions use optimistic
+    # WATCH/MULTI/EXEC and retry on conflict instead of locking, so mutate must be safe to re-run.
+    if redis_client is None:
+        async with get_session_lock(session_id):
+            session = _ensure_session_history(session_id)
+            result, _ = mutate(session)
+            # Re-inserting restarts the idle TTL, like SET ... EX does for Redis sessions
+            session_histories[session_id] = session
+            return result
+
+    key = _redis_key(session_id)
+    async with redis_client.pipeline(transaction=True) as pipe:
+        for attempt in range(1, SESSION_UPDATE_MAX_RETRIES + 1):
+            try:
+                await pipe.watch(key)
+                raw = await pipe.get(key)
+                session = _session_from_json(raw) if raw else _new_session()
+                result, changed = mutate(session)
+                if raw and not changed:
+                    return result
+                pipe.multi()
+                pipe.set(key, _session_to_json(session), ex=SESSION_TTL_SECONDS)
+                await pipe.execute()
+                return result
+            except WatchError:
+                logging.info(f"Session {session_id} - Concurrent update detected (attempt {attempt}), retrying.")
+                await asyncio.sleep(random.uniform(0, 0.005 * attempt))
+    raise RuntimeError(f"Session {session_id} - Gave up updating session after {SESSION_UPDATE_MAX_RETRIES} concurrent-update conflicts.")
+
+async def session_exists(session_id):
+    if redis_client is None:
+        return session_id in session_histories
+    return bool(await redis_client.exists(_redis_key(session_id)))
+
+def estimate_tokens(text):
+    # Cheap ~4 characters per token approximation, good enough for budgeting without a tokenizer.
+    return len(text) // 4 + 1
+
+def _evict_to_token_budget(session, static_system):
+    # Caller must already hold the session lock. When the system prompt plus history exceeds
+    # MAX_HISTORY_TOKENS, drops the oldest committed messages until it fits EVICTION_TARGET_TOKENS,
+    # and returns how many were dropped.
+    committed = session["committed"]
+    assistant = MessageRole.ASSISTANT
+    total = estimate_tokens(static_system) + sum(estimate_tokens(m.content) for m in committed)
+    if total <= MAX_HISTORY_TOKENS:
+        return 0
+    evicted = 0
+    while committed and total > EVICTION_TARGET_TOKENS:
+        total -= estimate_tokens(committed.popleft().content)
+        evicted += 1
+    # Never leave an orphaned assistant reply at the head of the history
+    while committed and committed[0].role == assistant:
+        committed.popleft()
+        evicted += 1
+    return evicted
+
+# Strong references to in-flight background tasks (asyncio only keeps weak ones) and the sessions being summarized
+_background_tasks = set()
+_summarizing_sessions = set()
+
+def _spawn_background(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+async def summarize_session_history(session_id, llm):
+    try:
+        def _take_oldest(session):
+            if len(session["committed"]) <= SUMMARY_THRESHOLD:
+                return None, False
+            old_slice = list(itertools.islice(session["committed"], SUMMARY_BATCH))
+            while old_slice and old_slice[-1].role != MessageRole.ASSISTANT:
+                old_slice.pop()
+            return old_slice or None, False
+
+        old_slice = await update_session(session_id, _take_oldest)
+        if not old_slice:
+            return
+
+        transcript = "\n".join(f"{m.role.value}: {m.content}" for m in old_slice)
+        summary_prompt = f"Summarize the following conversation in at most 200 tokens, keeping any facts the assistant may need later:\n\n{transcript}"
+        summary_resp = await llm.achat([ChatMessage(role=MessageRole.USER, content=summary_prompt)])
+        summary = summary_resp.message.content or ""
+        if not summary.strip():
+            # Keep the original messages rather than replacing them with an empty summary
+            logging.warning(f"Session {session_id} - LLM returned an empty summary, keeping the original history.")
+            return
+
+        def _replace_oldest(session):
+            # The history may have been cleared or evicted while the LLM was summarizing; only
+            # replace the slice if it is still exactly what was summarized.
+            committed = session["committed"]
+            if list(itertools.islice(committed, len(old_slice))) != old_slice:
+                return None, False
+            for _ in old_slice:
+                committed.popleft()
+            committed.appendleft(ChatMessage(role=MessageRole.SYSTEM, content=f"Prior conversation summary: {summary}"))
+            return len(committed), True
+
+        history_size = await update_session(session_id, _replace_oldest)
+        if history_size is not None:
+            logging.info(f"Session {session_id} - Summarized {len(old_slice)} oldest messages. History size: {history_size}")
+    except Exception as e:
+        logging.error(f"Error summarizing history for session {session_id}: {e}", exc_info=True)
+    finally:
+        _summarizing_sessions.discard(session_id)
+
+@functools.lru_cache(maxsize=16)
+def get_llm(model_id, api_key):
+    # One client per model so its HTTP connection pool (and keep-alive connections) is reused across
+    # requests; the underlying httpx async client is safe to share between concurrent streams.
+    return LlamaGroq(model=model_id, api_key=api_key)
+
+_SSE_PREFIX = b"data: "
+_SSE_SUFFIX = b"\n\n"
+
+def sse_event(payload):
+    # orjson returns bytes, so frames are written to the socket without a separate encode step
+    return _SSE_PREFIX + orjson.dumps(payload) + _SSE_SUFFIX
+
+# The client already accumulates text_chunk deltas, so the stream ends with a bare terminator
+# instead of re-sending the whole response.
+_FINAL_EVENT = sse_event({'is_final': True})
+# Constant error frames are encoded once rather than on every failed request
+_ERR_NO_SESSION = sse_event({'error': 'session_id is required for backend history', 'is_final': True})
+_ERR_NO_PROMPT = sse_event({'error': 'Prompt is required', 'is_final': True})
+_ERR_NO_KEY = sse_event({'error': 'GROQ_API_KEY not configured on server.', 'is_final': True})
+
+async def persist_turn(session_id, system_prompt_text, user_chat_message, full_response_content, llm):
+    try:
+        def _commit_turn(session):
+            # A changed system prompt starts a new cache epoch instead of editing history in place
+            new_epoch = bool(system_prompt_text) and session["system_prompt"] != system_prompt_text
+            if new_epoch:
+                session["system_prompt"] = system_prompt_text
+
+            # Committed history is append-only so the cached prefix stays valid
+            session["committed"].append(user_chat_message)
+            session["committed"].append(ChatMessage(role=MessageRole.ASSISTANT, content=full_response_content))
+            return (new_epoch, len(session["committed"])), True
+
+        new_epoch, history_size = await update_session(session_id, _commit_turn)
+        if new_epoch:
+            logging.info(f"Session {session_id} - System prompt changed, starting new prompt cache epoch.")
+        logging.info(f"Session {session_id} - Persisted turn. History size: {history_size}")
+
+        if history_size > SUMMARY_THRESHOLD and session_id not in _summarizing_sessions:
+            _summarizing_sessions.add(session_id)
+            await summarize_session_history(session_id, llm)
+    except Exception as e:
+        logging.error(f"Error persisting history for session {session_id}: {e}", exc_info=True)
+
+async def initialize_session_history(session_id):
+    await update_session(session_id, lambda session: (None, False))
+
+@app.get('/')
+async def serve_index():
+    return FileResponse(INDEX_HTML)
+
+@app.post('/create-session')
+async def create_session_route():
     try:
         session_id = str(uuid4())
-        initialize_session_history(session_id)
+        await initialize_session_history(session_id)
         logging.info(f"New backend session created: {session_id}")
-        return jsonify({'status': 'success', 'session_id': session_id}), 200
+        return ORJSONResponse({'status': 'success', 'session_id': session_id}, status_code=200)
     except Exception as e:
         logging.error(f"Error in /create-session: {str(e)}")
-        return jsonify({'status': 'error', 'message': str(e)}), 500
+        return ORJSONResponse({'status': 'error', 'message': str(e)}, status_code=500)
 
-@app.route('/clear-backend-history', methods=['POST'])
-def clear_backend_history_route():
-    data = request.json
-    session_id = data.get('session_id')
+@app.post('/clear-backend-history')
+async def clear_backend_history_route(request: Request):
+    # orjson instead of Request.json(), which parses with the stdlib json module
+    try:
+        data = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        data = None
+    session_id = data.get('session_id') if isinstance(data, dict) else None
     if not session_id:
-        return jsonify({'status': 'error', 'message': 'session_id is required'}), 400
-
-    with history_lock:
-        if session_id in session_histories:
-            session_histories[session_id] = []
-            logging.info(f"Backend chat history cleared for session: {session_id}")
-            message = 'Backend chat history cleared for this session.'
-        else:
-            # It's okay if the session wasn't on backend yet, initialize it empty.
-            initialize_session_history(session_id)
-            logging.warning(f"Attempted to clear history for session not actively on backend (or new): {session_id}. Initialized empty.")
-            message = 'Backend session history was not found (or was new) and is now initialized empty.'
-            
-    return jsonify({'status': 'success', 'message': message})
-
-
-def generate_chat_stream_with_session(payload):
-    session_id = payload.get('session_id')
-    user_prompt_text = payload.get('prompt')
-    system_prompt_text = payload.get('system_prompt', "").strip() # Default to empty if not provided
-    temperature = float(payload.get('temperature', 0.7))
-    model_id = payload.get('model_id', 'llama3-8b-8192')
+        return ORJSONResponse({'status': 'error', 'message': 'session_id is required'}, status_code=400)
+
+    def _reset(session):
+        session.clear()
+        session.update(_new_session())
+        return None, True
+
+    existed = await session_exists(session_id)
+    # It's okay if the session wasn't on backend yet, this initializes it empty.
+    await update_session(session_id, _reset)
+    if existed:
+        logging.info(f"Backend chat history cleared for session: {session_id}")
+        message = 'Backend chat history cleared for this session.'
+    else:
+        logging.warning(f"Attempted to clear history for session not actively on backend (or new): {session_id}. Initialized empty.")
+        message = 'Backend session history was not found (or was new) and is now initialized empty.'
+
+    return ORJSONResponse({'status': 'success', 'message': message})
+
+
+async def generate_chat_stream_with_session(req):
+    session_id = req.session_id
+    user_prompt_text = req.prompt
+    system_prompt_text = req.system_prompt.strip()
+    temperature = req.temperature
+    model_id = req.model_id
 
     if not session_id:
-        yield f"data: {json.dumps({'error': 'session_id is required for backend history', 'is_final': True})}\n\n"
+        yield _ERR_NO_SESSION
         return
     if not user_prompt_text:
-        yield f"data: {json.dumps({'error': 'Prompt is required', 'is_final': True})}\n\n"
+        yield _ERR_NO_PROMPT
         return
 
-    api_key_to_use = os.environ.get("GROQ_API_KEY")
-    # If you must use a hardcoded key for testing and GROQ_API_KEY is not set:
-    # if not api_key_to_use:
-    #     api_key_to_use = "gsk_YOUR_GROQ_API_KEY" # Replace with your actual key if needed for testing
-
-    if not api_key_to_use:
+    if not GROQ_API_KEY:
         logging.error("GROQ_API_KEY not found in environment variables.")
-        yield f"data: {json.dumps({'error': 'GROQ_API_KEY not configured on server.', 'is_final': True})}\n\n"
+        yield _ERR_NO_KEY
         return
 
     try:
-        llm = LlamaGroq(model=model_id, api_key=api_key_to_use)
-        
-        messages_for_llm = []
-        with history_lock:
-            # Retrieve current history for the session (list of dicts)
-            current_history_dicts = list(session_histories.get(session_id, [])) # Make a copy
-
-            # Handle System Prompt:
-            # Prepend system prompt if provided and not already the first message, or if history is empty.
-            # This allows changing system prompt mid-conversation to take effect.
-            if system_prompt_text:
-                if not current_history_dicts or current_history_dicts[0].get("role") != MessageRole.SYSTEM:
-                    messages_for_llm.append(ChatMessage(role=MessageRole.SYSTEM, content=system_prompt_text))
-                elif current_history_dicts[0].get("role") == MessageRole.SYSTEM and current_history_dicts[0].get("content") != system_prompt_text:
-                    # If system prompt exists but changed, replace it
-                    current_history_dicts[0]["content"] = system_prompt_text # Update history for next time
-                    messages_for_llm.append(ChatMessage(role=MessageRole.SYSTEM, content=system_prompt_text))
-
-
-            # Convert stored history dicts to ChatMessage objects
-            for msg_dict in current_history_dicts:
-                # Avoid adding system message again if already handled
-                if msg_dict.get("role") == MessageRole.SYSTEM and messages_for_llm and messages_for_llm[0].role == MessageRole.SYSTEM:
-                    continue
-                messages_for_llm.append(ChatMessage(role=MessageRole(msg_dict["role"]), content=str(msg_dict["content"])))
-        
-        # Add current user prompt
+        llm = get_llm(model_id, GROQ_API_KEY)
+
+        # History is stored as ChatMessage objects, so only the system and new user messages are built per turn.
         user_chat_message = ChatMessage(role=MessageRole.USER, content=user_prompt_text)
-        messages_for_llm.append(user_chat_message)
+
+        def _prepare(session):
+            # An empty system prompt keeps whatever the session already uses.
+            static_system = system_prompt_text or session["system_prompt"]
+            evicted = _evict_to_token_budget(session, static_system)
+            # Build a byte-stable prefix [static system][committed history] and only append at the tail,
+            # so provider-side prompt caching keeps hitting across turns. Reading the live history here
+            # needs no snapshot copy: mutate runs without awaiting, so nothing can change it meanwhile.
+            messages = [ChatMessage(role=MessageRole.SYSTEM, content=static_system)] if static_system else []
+            messages.extend(session["committed"])
+            messages.append(user_chat_message)
+            return (evicted, messages), evicted > 0
+
+        evicted, messages_for_llm = await update_session(session_id, _prepare)
+        if evicted:
+            logging.info(f"Session {session_id} - Evicted {evicted} oldest messages to stay within {MAX_HISTORY_TOKENS} tokens.")
 
         logging.info(f"Session {session_id} - Calling LLM '{model_id}' with {len(messages_for_llm)} messages. System: '{system_prompt_text[:30]}...', User: '{user_prompt_text[:50]}...'")
 
-        stream_resp = llm.stream_chat(messages_for_llm, temperature=temperature)
+        # astream_chat is natively async (LlamaGroq streams through the AsyncOpenAI/httpx client), so the
+        # event loop is never blocked here and no thread offload of the sync stream_chat is needed.
+        stream_resp = await llm.astream_chat(messages_for_llm, temperature=temperature)
 
-        full_response_content = ""
-        for r_chunk in stream_resp:
+        parts = []
+        buf = []
+        buf_len = 0
+        last_flush = time.monotonic()
+        async for r_chunk in stream_resp:
             delta_content = r_chunk.delta
             if delta_content:
-                full_response_content += delta_content
-                yield f"data: {json.dumps({'text_chunk': delta_content, 'is_final': False})}\n\n"
+                parts.append(delta_content)
+                buf.append(delta_content)
+                buf_len += len(delta_content)
+                now = time.monotonic()
+                if buf_len >= STREAM_FLUSH_CHARS or now - last_flush > STREAM_FLUSH_INTERVAL:
+                    yield sse_event({'text_chunk': ''.join(buf), 'is_final': False})
+                    buf.clear()
+                    buf_len = 0
+                    last_flush = now
+        if buf:
+            yield sse_event({'text_chunk': ''.join(buf), 'is_final': False})
+        full_response_content = "".join(parts)
         
-        # Persist messages to session history
-        with history_lock:
-            # Ensure session_id key exists
-            if session_id not in session_histories:
-                 initialize_session_history(session_id)
-
-            # Update system prompt in history if it was added/changed
-            if system_prompt_text:
-                if not session_histories[session_id] or session_histories[session_id][0].get("role") != MessageRole.SYSTEM:
-                    session_histories[session_id].insert(0, {"role": MessageRole.SYSTEM, "content": system_prompt_text})
-                elif session_histories[session_id][0].get("role") == MessageRole.SYSTEM and session_histories[session_id][0].get("content") != system_prompt_text:
-                     session_histories[session_id][0]["content"] = system_prompt_text
-
-
-            session_histories[session_id].append({"role": MessageRole.USER, "content": user_prompt_text})
-            session_histories[session_id].append({"role": MessageRole.ASSISTANT, "content": full_response_content})
-            # Optional: Limit history size to prevent excessive memory usage
-            # MAX_HISTORY_LEN = 50 # Example: keep last 50 messages (25 pairs)
-            # if len(session_histories[session_id]) > MAX_HISTORY_LEN:
-            #     session_histories[session_id] = session_histories[session_id][-MAX_HISTORY_LEN:]
-
-
-        logging.info(f"Session {session_id} - LLM full response length: {len(full_response_content)}. History size: {len(session_histories.get(session_id, []))}")
-        yield f"data: {json.dumps({'full_response': full_response_content, 'is_final': True})}\n\n"
+        logging.info(f"Session {session_id} - LLM full response length: {len(full_response_content)}.")
+        try:
+            yield _FINAL_EVENT
+        finally:
+            # Write-behind: persist only after the terminator has gone out (or the client has gone away),
+            # so storage latency never delays the end of the stream.
+            _spawn_background(persist_turn(session_id, system_prompt_text, user_chat_message, full_response_content, llm))
 
     except Exception as e:
         logging.error(f"Error in Groq stream for session {session_id}: {e}", exc_info=True)
-        yield f"data: {json.dumps({'error': f'LLM Error: {str(e)}', 'is_final': True})}\n\n"
-
-
-@app.route('/chat', methods=['POST'])
-def chat_route_post():
-    payload = request.json
-    session_id = payload.get('session_id')
-    
-    # Ensure session history is initialized on the backend if accessed directly
-    # (though frontend should call /create-session first)
-    if session_id:
-        initialize_session_history(session_id) 
-    else: # Should not happen if frontend is working correctly
+        yield sse_event({'error': f'LLM Error: {str(e)}', 'is_final': True})
+
+
+@app.post('/chat')
+async def chat_route_post(req: ChatRequest):
+    # No separate initialization here: update_session creates a missing session on first use.
+    if not req.session_id: # Should not happen if frontend is working correctly
+        # Better to error out than invent a session_id the frontend won't know about;
+        # generate_chat_stream_with_session will report the error.
         logging.error("Chat request received without session_id in payload.")
-        # Fallback: create one, but this indicates a frontend issue
-        # session_id = str(uuid4())
-        # initialize_session_history(session_id)
-        # payload['session_id'] = session_id 
-        # This part is risky as frontend won't know this session_id for subsequent calls
-        # Better to error out if session_id is missing and expected.
-        # For now, generate_chat_stream_with_session will handle the error.
-        pass
-        
-    return Response(generate_chat_stream_with_session(payload), mimetype='text/event-stream')
+
+    return StreamingResponse(generate_chat_stream_with_session(req), media_type='text/event-stream')
 
 if __name__ == '__main__':
-    if not os.environ.get("GROQ_API_KEY"):
-        # This is the API key from your new app.py. 
-        # For security, it's best to set GROQ_API_KEY as an environment variable.
-        # Example: export GROQ_API_KEY="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"
-        logging.warning("GROQ_API_KEY not found in environment variables. LLM calls might fail or use a test key if hardcoded (not recommended for production).")
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1 and not REDIS_URL:
+        logging.warning("WEB_CONCURRENCY > 1 without REDIS_URL: sessions are per-worker and will appear lost between requests.")
+    # An import string (not the app object) is required for uvicorn to spawn multiple workers
+    uvicorn.run(
+        "app:app",
+        host='0.0.0.0',
+        port=5000,
+        workers=workers,
+        loop='uvloop',
+        http='httptools',
+        limit_concurrency=1024,
+        timeout_keep_alive=75,
+    )
\ No newline at end of file